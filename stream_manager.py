@@ -4,7 +4,9 @@ Live Stream Switcher
 Cycles through YouTube live camera streams with seamless switching.
 
 Uses a single persistent ffmpeg process reading from stdin via a buffer thread.
-Camera switches are done by swapping which yt-dlp process the buffer reads from.
+Each camera feed only remuxes its source to MPEG-TS; the persistent ffmpeg does
+the one encode. Camera switches are done by swapping which feed process the
+buffer reads from.
 This keeps the output stream (HLS preview or YouTube RTMP) continuous.
 
 Supports multiple streams via config inheritance:
@@ -20,15 +22,28 @@ import subprocess
 import threading
 import tempfile
 import select
+import selectors
+import socket
+import fcntl
+import errno
+import mmap
 import logging
 import argparse
 import re
+import shutil
 from pathlib import Path
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from queue import Queue, Empty
-from copy import deepcopy
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field, fields
 
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 import yt_dlp
 import colorlog
 from colorlog import ColoredFormatter
@@ -36,14 +51,23 @@ from dotenv import load_dotenv
 
 SCRIPT_DIR = Path(__file__).parent
 
+# Resolved once: an absolute path spares execvp() a PATH search on every
+# spawn. Popen already uses vfork() for these children (no preexec_fn).
+FFMPEG = shutil.which("ffmpeg") or "ffmpeg"
+
 # Load environment variables from .env file
 load_dotenv(SCRIPT_DIR / ".env")
 
 logger = None
 config = None
+music_mix_filter = None  # Audio filter graph, built once by load_config
+music_path = None  # Resolved music file, or None if unset/missing
 current_camera_index = 0
 running = False
 stop_event = threading.Event()
+# Wakes stream_loop early: a child process exited, a new feed started
+# delivering, or shutdown was requested
+wake_event = threading.Event()
 
 http_server = None
 hls_dir = None
@@ -54,8 +78,17 @@ ffmpeg_proc = None
 # Buffer thread and camera switching
 buffer_thread = None
 buffer_stop_event = threading.Event()
-current_camera_proc = None  # The yt-dlp + ffmpeg normalizer pipeline
+current_camera_proc = None  # The camera's ffmpeg source process
+camera_prebuffer = None  # Chunks to write before reading from current_camera_proc
 camera_lock = threading.Lock()
+camera_flowing = threading.Event()  # Set once the current camera's bytes reach ffmpeg
+
+# Start the next camera this many seconds before its switch
+PREFETCH_SECS = 3
+# Keep at most this many of the newest prefetched chunks (~2 MiB)
+PREFETCH_CHUNKS = 32
+PREFETCH_CHUNK_SIZE = 65536
+TS_PACKET_SIZE = 188
 
 
 def setup_logging():
@@ -79,19 +112,109 @@ def setup_logging():
     logger.setLevel(logging.INFO)
 
 
+# ─── Config Types ─────────────────────────────────────────────────────────
+
+# Read-only config records; slotted on Python 3.10+ (smaller instances,
+# attribute reads skip the instance dict)
+config_record = dataclass(frozen=True, **({"slots": True} if sys.version_info >= (3, 10) else {}))
+
+
+@config_record
+class Camera:
+    name: str
+    youtube_id: str = ""
+    stream_url: str = ""
+
+
+@config_record
+class YouTubeConfig:
+    rtmp_url: str = ""
+    stream_key: str = field(default="", repr=False)
+
+
+@config_record
+class StreamConfig:
+    switch_interval: int = 15
+    preview_mode: bool = True
+    youtube: YouTubeConfig = field(default_factory=YouTubeConfig)
+
+
+@config_record
+class FFmpegConfig:
+    resolution: str = "1920x1080"
+    video_bitrate: str = "6800k"
+    audio_bitrate: str = "128k"
+    framerate: int = 30
+    keyframe_interval: float = 2  # Seconds between keyframes (GOP length)
+    encoder: str = "auto"  # auto, libx264, vaapi, qsv, nvenc, videotoolbox or copy
+
+
+@config_record
+class AudioConfig:
+    music_file: str = ""
+    music_volume: float = 0.3
+    include_camera_audio: bool = True
+    camera_audio_volume: float = 0.7
+
+
+@config_record
+class RuntimeConfig:
+    cpu_mask: str = ""  # CPU list reserved for this process, e.g. "0" or "0-1"
+
+
+@config_record
+class AppConfig:
+    name: str
+    cameras: tuple
+    stream: StreamConfig
+    ffmpeg: FFmpegConfig
+    audio: AudioConfig
+    runtime: RuntimeConfig = field(default_factory=RuntimeConfig)
+
+
+def from_dict(cls, values):
+    """Build a config dataclass from a YAML mapping, ignoring unknown keys."""
+    known = {f.name for f in fields(cls)}
+    return cls(**{k: v for k, v in (values or {}).items() if k in known})
+
+
+def build_config(raw):
+    """Convert the merged config dict into typed, read-only config objects."""
+    stream_raw = dict(raw.get('stream') or {})
+    stream_raw['youtube'] = from_dict(YouTubeConfig, stream_raw.get('youtube'))
+    return AppConfig(
+        name=raw['name'],
+        cameras=tuple(from_dict(Camera, c) for c in raw.get('cameras') or ()),
+        stream=from_dict(StreamConfig, stream_raw),
+        ffmpeg=from_dict(FFmpegConfig, raw.get('ffmpeg')),
+        audio=from_dict(AudioConfig, raw.get('audio')),
+        runtime=from_dict(RuntimeConfig, raw.get('runtime')),
+    )
+
+
 # ─── Config Loading ───────────────────────────────────────────────────────
 
+_ENV_RE = re.compile(r'\$\{(\w+)\}')
+_env_cache = {}
+
+
+def _env_lookup(match):
+    """Substitute one ${VAR_NAME} match, warning once per unset variable."""
+    var_name = match.group(1)
+    env_value = _env_cache.get(var_name)
+    if env_value is None:
+        env_value = _env_cache[var_name] = os.environ.get(var_name, '')
+        if not env_value:
+            logger.warning(f"Environment variable {var_name} is not set")
+    return env_value
+
+
 def expand_env_vars(value):
     """Recursively expand ${VAR_NAME} patterns in config values."""
     if isinstance(value, str):
-        pattern = r'\$\{(\w+)\}'
-        def replace(match):
-            var_name = match.group(1)
-            env_value = os.environ.get(var_name, '')
-            if not env_value:
-                logger.warning(f"Environment variable {var_name} is not set")
-            return env_value
-        return re.sub(pattern, replace, value)
+        if '${' not in value:
+            return value
+        return _ENV_RE.sub(_env_lookup, value)
     elif isinstance(value, dict):
         return {k: expand_env_vars(v) for k, v in value.items()}
     elif isinstance(value, list):
@@ -100,15 +223,13 @@ def expand_env_vars(value):
         return value
 
 
-def deep_merge(base, override):
-    """Deep merge override dict into base dict. Override takes precedence."""
-    result = deepcopy(base)
+def _merge_into(dst, override):
+    """Deep merge override dict into dst in place. Override takes precedence."""
     for key, value in override.items():
-        if key in result and isinstance(result[key], dict) and isinstance(value, dict):
-            result[key] = deep_merge(result[key], value)
+        if isinstance(value, dict) and isinstance(dst.get(key), dict):
+            _merge_into(dst[key], value)
         else:
-            result[key] = value
-    return result
+            dst[key] = value
 
 
 def derive_stream_key_env(stream_name):
@@ -116,18 +237,48 @@ def derive_stream_key_env(stream_name):
     return f"YOUTUBE_KEY_{stream_name.upper().replace('-', '_')}"
 
 
+# Camera audio arrives with a timestamp jump at every switch;
+# aresample pads/trims it back onto a continuous timeline
+CAMERA_AUDIO_FILTER = "aresample=async=1:first_pts=0"
+
+
+def build_music_mix_filter(audio):
+    """filter_complex graph mixing camera audio (input 0) with music (input 1)."""
+    return (
+        f"[0:a]{CAMERA_AUDIO_FILTER}[cam];"
+        f"[1:a]volume={audio.music_volume}[music];"
+        f"[cam][music]amix=inputs=2:duration=first:dropout_transition=0[aout]"
+    )
+
+
+def resolve_music_file(music_file):
+    """Absolute path of the background music file, or None if unset/missing."""
+    if not music_file:
+        return None
+    path = Path(music_file)
+    if not path.is_absolute():
+        path = SCRIPT_DIR / path
+    if not path.is_file():
+        logger.warning(f"Music file not found, streaming camera audio only: {path}")
+        return None
+    return str(path)
+
+
 def load_config(stream_config_path, base_config_path=None):
     """Load configuration with inheritance from base config."""
-    global config
+    global config, music_mix_filter, music_path
     
     stream_path = Path(stream_config_path)
     if not stream_path.exists():
         logger.error(f"Stream config file not found: {stream_path}")
         sys.exit(1)
     
+    if not getattr(yaml, "__with_libyaml__", False):
+        logger.warning("PyYAML built without LibYAML; config parsing uses the slower pure-Python loader")
+
     # Load stream config
     with open(stream_path) as f:
-        stream_cfg = yaml.safe_load(f)
+        stream_cfg = yaml.load(f, Loader=SafeLoader)
     
     # Get display name from config, derive env var name from filename
     display_name = stream_cfg.get('name') or stream_path.stem
@@ -139,18 +290,20 @@ def load_config(stream_config_path, base_config_path=None):
         base_path = Path(base_config_path)
         if base_path.exists():
             with open(base_path) as f:
-                base_cfg = yaml.safe_load(f) or {}
+                base_cfg = yaml.load(f, Loader=SafeLoader) or {}
     
-    # Deep merge: base first, then stream overrides
-    config = deep_merge(base_cfg, stream_cfg)
+    # Deep merge: base first, then stream overrides. Both dicts were just
+    # parsed and nothing else holds them, so merge in place without copying.
+    merged = base_cfg
+    _merge_into(merged, stream_cfg)
     
     # Set stream name if not in config
-    if 'name' not in config:
-        config['name'] = display_name
+    if 'name' not in merged:
+        merged['name'] = display_name
     
     # Handle stream key: either from explicit config or derived from env var
-    stream_opts = config.get('stream', {})
-    youtube_opts = stream_opts.get('youtube', {})
+    stream_opts = merged.setdefault('stream', {})
+    youtube_opts = stream_opts.setdefault('youtube', {})
     
     if 'stream_key' not in youtube_opts:
         # Try to get from env var - use filename for derivation
@@ -165,27 +318,72 @@ def load_config(stream_config_path, base_config_path=None):
                           f"Expected env var {env_var} to be set.")
     
     # Expand any ${VAR} patterns in config
-    config = expand_env_vars(config)
+    config = build_config(expand_env_vars(merged))
+    music_mix_filter = build_music_mix_filter(config.audio)
+    music_path = resolve_music_file(config.audio.music_file)
     
-    logger.info(f"Loaded config for stream: {config.get('name', 'unnamed')}")
-    logger.info(f"Switch interval: {config['stream']['switch_interval']} seconds")
-    logger.info(f"Preview mode: {config['stream'].get('preview_mode', True)}")
+    logger.info(f"Loaded config for stream: {config.name}")
+    logger.info(f"Switch interval: {config.stream.switch_interval} seconds")
+    logger.info(f"Preview mode: {config.stream.preview_mode}")
 
 
 # ─── HLS preview server ────────────────────────────────────────────────
 
-class StreamHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/health":
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"OK")
-        elif self.path == "/" or self.path == "/index.html":
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
-            self.end_headers()
-            self.wfile.write(b"""<!DOCTYPE html>
+class SegmentCache:
+    """Byte-capped LRU of HLS file contents shared by all preview clients.
+
+    Entries are keyed by (path, mtime, size), so a rewritten playlist is a
+    miss. With several players watching, each segment is read from disk
+    once instead of once per client.
+
+    Immutable segments are mmap'd rather than read into the Python heap;
+    the mapping stays valid after ffmpeg deletes the file. Evicted maps are
+    not closed explicitly, since a handler may still be sending one; they
+    unmap when the last reference goes.
+    """
+
+    def __init__(self, capacity=64 << 20, max_item=2 << 20):
+        self.capacity = capacity
+        self.max_item = max_item
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get_or_load(self, path, immutable=False):
+        """Return the file's contents, or None if it is too big to cache.
+
+        Pass immutable=True only for files that are never rewritten in
+        place (HLS segments): touching a mapping of a truncated file raises
+        SIGBUS.
+        """
+        st = os.stat(path)
+        if st.st_size > self.max_item:
+            return None
+        key = (str(path), st.st_mtime_ns, st.st_size)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                return data
+        with open(path, "rb") as f:
+            if immutable and st.st_size:
+                data = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+            else:
+                data = f.read()
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = data
+                self.size += len(data)
+                while self.size > self.capacity:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
+
+segment_cache = SegmentCache()
+
+
+INDEX_HTML = b"""<!DOCTYPE html>
 <html><head><title>Live Stream Preview</title>
 <script src="https://cdn.jsdelivr.net/npm/hls.js@latest"></script>
 <style>
@@ -230,310 +428,1024 @@ if (Hls.isSupported()) {
     });
 }
 </script>
-</body></html>""")
-        elif self.path.startswith("/stream/"):
-            filepath = Path(hls_dir) / self.path[8:]
-            if filepath.exists():
-                self.send_response(200)
-                if self.path.endswith(".m3u8"):
-                    self.send_header("Content-Type", "application/vnd.apple.mpegurl")
-                    self.send_header("Cache-Control", "no-cache")
-                else:
-                    self.send_header("Content-Type", "video/MP2T")
-                    self.send_header("Cache-Control", "no-cache")
-                self.end_headers()
-                try:
-                    with open(filepath, "rb") as f:
-                        self.wfile.write(f.read())
-                except Exception:
-                    pass
+</body></html>"""
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    # Keep-alive: every response carries a Content-Length
+    protocol_version = "HTTP/1.1"
+    # Socket timeout: a stalled or idle client gives up its thread and fds
+    timeout = 5.0
+
+    def setup(self):
+        super().setup()
+        # Small playlist responses shouldn't wait on Nagle's algorithm
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @contextmanager
+    def corked(self):
+        """Coalesce headers and body into full packets (Linux TCP_CORK)."""
+        if not hasattr(socket, "TCP_CORK"):
+            yield
+            return
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            yield
+        finally:
+            try:
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            except OSError:
+                pass
+
+    # HLS output directory; set by start_http_server
+    hls_root = None
+
+    def do_GET(self):
+        path = self.path
+        if path == "/health":
+            self.send_body(b"OK", "text/plain", "no-store")
+        elif path == "/" or path == "/index.html":
+            self.send_body(INDEX_HTML, "text/html; charset=utf-8", "public, max-age=60")
+        elif path.startswith("/stream/"):
+            filepath = self.hls_root / path[8:]
+            if path.endswith(".m3u8"):
+                content_type = "application/vnd.apple.mpegurl"
+                cache_control = "no-store"
+                immutable = False
+            elif path.endswith(".mp4"):
+                # fMP4 init segment: rewritten if ffmpeg restarts
+                content_type = "video/mp4"
+                cache_control = "no-cache"
+                immutable = False
             else:
+                # Segment names are never reused, so clients may cache them
+                if path.endswith(".m4s"):
+                    content_type = "video/iso.segment"
+                else:
+                    content_type = "video/MP2T"
+                cache_control = "max-age=60, immutable"
+                immutable = True
+            # No exists() check first: ffmpeg deletes old segments at any
+            # moment, so a missing file is only known once we try it
+            try:
+                body = segment_cache.get_or_load(filepath, immutable)
+                if body is None:
+                    self.send_file(filepath, content_type, cache_control)
+                else:
+                    self.send_body(body, content_type, cache_control)
+            except (FileNotFoundError, IsADirectoryError):
                 self.send_error(404)
+                return
+            except Exception:
+                self.close_connection = True
+                return
+            if path.endswith(".m3u8"):
+                prefetch_segments(filepath)
         else:
             self.send_error(404)
 
+    def send_body(self, body, content_type, cache_control):
+        """Send an in-memory response body."""
+        with self.corked():
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", cache_control)
+            self.end_headers()
+            self.wfile.write(body)
+
+    def send_file(self, filepath, content_type, cache_control):
+        """Send a file body with sendfile(), falling back to a buffered copy.
+
+        The segment bytes go straight from the page cache to the socket
+        instead of being read into a Python bytes object first. With the
+        handler timeout set, socket.sendfile() waits for writability
+        between chunks and raises TimeoutError if the client stalls.
+        """
+        with open(filepath, "rb") as f, self.corked():
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(size))
+            self.send_header("Cache-Control", cache_control)
+            self.end_headers()
+            self.wfile.flush()
+            self.connection.sendfile(f, 0, size)
+
     def log_message(self, format, *args):
         pass
 
 
+def prefetch_segments(playlist_path):
+    """Ask the kernel to read ahead the segments a playlist lists.
+
+    Players fetch those segments right after the playlist, so warming the
+    page cache now keeps their GETs off the disk.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        lines = playlist_path.read_text().splitlines()
+    except OSError:
+        return
+    for line in lines:
+        if not line or line.startswith("#"):
+            continue
+        try:
+            fd = os.open(playlist_path.parent / line, os.O_RDONLY)
+        except OSError:
+            continue  # Already rotated out
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+class PreviewServer(ThreadingHTTPServer):
+    # Handler threads don't hold up shutdown
+    daemon_threads = True
+    # listen() backlog; the default of 5 drops SYNs when several players
+    # open their playlist and segment connections at once
+    request_queue_size = 64
+
+
 def start_http_server(port):
-    """Start HTTP server for HLS preview."""
+    """Start HTTP server for HLS preview.
+
+    Each request gets its own thread so a player fetching the playlist and
+    several segments at once isn't serialized behind a single slow GET.
+    """
     global http_server
-    server = HTTPServer(("", port), StreamHandler)
+    StreamHandler.hls_root = Path(hls_dir)
+    server = PreviewServer(("", port), StreamHandler)
     http_server = server
     logger.info(f"HLS preview server on http://localhost:{port}")
     server.serve_forever()
 
 
+# ─── CPU Placement ─────────────────────────────────────────────────────
+
+# Split the CPUs we may run on between the encoder and the camera feeds,
+# so the processes' codec thread pools don't oversubscribe the host
+if hasattr(os, "sched_getaffinity"):
+    AVAILABLE_CPUS = sorted(os.sched_getaffinity(0))
+else:
+    AVAILABLE_CPUS = list(range(os.cpu_count() or 2))
+
+
+def split_cpus(cpus):
+    """Divide a CPU list between the encoder and the camera feeds.
+
+    Returns (encoder_threads, feed_threads, encoder_cpus, feed_cpus). On
+    small hosts the feeds share the encoder's CPUs.
+    """
+    encoder_threads = max(2, (len(cpus) + 1) // 2)
+    feed_threads = max(1, len(cpus) // 4)
+    encoder_cpus = set(cpus[:encoder_threads])
+    feed_cpus = set(cpus[encoder_threads:]) or encoder_cpus
+    return encoder_threads, feed_threads, encoder_cpus, feed_cpus
+
+
+ENCODER_THREADS, FEED_THREADS, ENCODER_CPUS, FEED_CPUS = split_cpus(AVAILABLE_CPUS)
+
+
+def parse_cpu_list(text):
+    """Parse a taskset-style CPU list such as "0" or "0-1,4"."""
+    cpus = set()
+    for part in str(text).split(","):
+        part = part.strip()
+        if part:
+            lo, _, hi = part.partition("-")
+            cpus.update(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+
+def reserve_cpus(mask):
+    """Pin this process to the CPUs in mask and keep ffmpeg children off them.
+
+    The buffer and HTTP threads then keep their caches instead of being
+    evicted by encoder worker threads. Must run before threads are started,
+    since they inherit the calling thread's affinity.
+    """
+    global ENCODER_THREADS, FEED_THREADS, ENCODER_CPUS, FEED_CPUS
+    if not mask or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        reserved = parse_cpu_list(mask) & set(AVAILABLE_CPUS)
+    except ValueError:
+        logger.warning(f"Ignoring invalid runtime.cpu_mask: {mask!r}")
+        return
+    rest = [c for c in AVAILABLE_CPUS if c not in reserved]
+    if not reserved or not rest:
+        logger.warning(f"runtime.cpu_mask {mask!r} leaves no CPUs to split; not pinning")
+        return
+    try:
+        os.sched_setaffinity(0, reserved)
+    except OSError as e:
+        logger.warning(f"Could not pin to CPUs {sorted(reserved)}: {e}")
+        return
+    ENCODER_THREADS, FEED_THREADS, ENCODER_CPUS, FEED_CPUS = split_cpus(rest)
+    logger.info(f"Pinned to CPUs {sorted(reserved)}; ffmpeg uses {rest}")
+
+
+def pin_process(proc, cpus):
+    """Restrict a child process to the given CPUs (Linux only)."""
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(proc.pid, cpus)
+    except OSError as e:
+        logger.debug(f"Could not set CPU affinity for pid {proc.pid}: {e}")
+
+
+# ─── Pipe Sizing ───────────────────────────────────────────────────────
+
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)  # Linux only
+PIPE_SIZE = 1 << 20  # ffmpeg stdin: a stalled encoder backs up < ~1 s
+FEED_PIPE_SIZE = 8 << 20  # Camera feeds: absorb bursts while we're descheduled
+
+
+def pipe_size_limit():
+    """Largest pipe buffer an unprivileged process may request."""
+    try:
+        with open("/proc/sys/fs/pipe-max-size") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return PIPE_SIZE
+
+
+# pipe-max-size is fixed for the life of the process; read it once
+PIPE_SIZE_LIMIT = pipe_size_limit()
+
+
+def enlarge_pipe(pipe, size=PIPE_SIZE):
+    """Grow a pipe's kernel buffer (default 64 KiB) so bursts don't stall.
+
+    A GOP boundary can arrive as several hundred KiB at once; with a small
+    pipe the writer blocks and the persistent ffmpeg sees jitter.
+    """
+    try:
+        size = fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, min(size, PIPE_SIZE_LIMIT))
+    except OSError as e:
+        logger.debug(f"Could not resize pipe: {e}")
+        return
+    # The kernel rounds up to a power-of-two number of pages
+    logger.debug(f"Pipe buffer is {size} bytes")
+
+
+# ─── Process Watching ──────────────────────────────────────────────────
+
+# Children's stderr pipes, drained by one thread: fd -> (name, pipe)
+stderr_selector = selectors.DefaultSelector()
+stderr_wakeup = None  # (read_fd, write_fd) self-pipe for new registrations
+stderr_lock = threading.Lock()
+
+
+def drain_stderr():
+    """Single thread that forwards every child's stderr to the log.
+
+    Every stderr=PIPE child needs a reader: once the pipe fills, the child
+    blocks on write() and stalls. One selector loop replaces a reader
+    thread per camera feed.
+    """
+    partial = {}  # fd -> incomplete last line
+    wake_fd = stderr_wakeup[0]
+    while True:
+        for key, _ in stderr_selector.select():
+            fd = key.fd
+            if fd == wake_fd:
+                os.read(fd, 4096)
+                continue
+            name, pipe = key.data
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                chunk = b""
+            if not chunk:
+                # Child closed stderr (exited): log its last line, forget it
+                stderr_selector.unregister(fd)
+                lines = [partial.pop(fd, b"")]
+                pipe.close()
+            else:
+                lines = (partial.pop(fd, b"") + chunk).split(b"\n")
+                if len(lines[-1]) < 65536:
+                    partial[fd] = lines.pop()
+            # Still drain the pipe when warnings are filtered, but skip the
+            # decode and f-string that logger.warning would then discard
+            if not logger.isEnabledFor(logging.WARNING):
+                continue
+            for line in lines:
+                line = line.decode(errors='replace').strip()
+                if line:
+                    logger.warning(f"{name}: {line}")
+
+
+def log_stderr(proc, name):
+    """Forward a child's stderr to the log via the shared drain thread."""
+    global stderr_wakeup
+    with stderr_lock:
+        if stderr_wakeup is None:
+            stderr_wakeup = os.pipe()
+            os.set_blocking(stderr_wakeup[1], False)
+            stderr_selector.register(stderr_wakeup[0], selectors.EVENT_READ)
+            threading.Thread(target=drain_stderr, daemon=True).start()
+        stderr_selector.register(proc.stderr.fileno(), selectors.EVENT_READ, (name, proc.stderr))
+    # Interrupt a select() that started before this fd was registered
+    try:
+        os.write(stderr_wakeup[1], b"\0")
+    except BlockingIOError:
+        pass  # A wakeup is already pending
+
+
+# Children the reaper watches, by pid
+watched_procs = {}
+watched_lock = threading.Lock()
+watched_added = threading.Event()
+reaper_thread = None
+
+
+def reap_children():
+    """Single thread that notices every child exit and wakes stream_loop.
+
+    Blocks in waitid(WNOWAIT), which reports an exited child without
+    reaping it; the owning Popen then reaps it via poll() so its
+    returncode stays correct. Costs no syscalls while children are alive.
+    """
+    while True:
+        try:
+            os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            # No children yet; wait until one is registered
+            watched_added.wait()
+            watched_added.clear()
+            continue
+        with watched_lock:
+            procs = list(watched_procs.values())
+        exited = [proc for proc in procs if proc.poll() is not None]
+        if not exited:
+            # Not ours, or another thread is mid-wait() on it; its owner
+            # will reap it shortly
+            time.sleep(0.01)
+            continue
+        with watched_lock:
+            for proc in exited:
+                watched_procs.pop(proc.pid, None)
+        wake_event.set()
+
+
+def watch_process(proc):
+    """Wake stream_loop as soon as proc exits.
+
+    Uses the shared reaper thread where os.waitid exists, else a waiter
+    thread for this child. Not a SIGCHLD handler: setting an Event from a
+    signal handler can deadlock on the Event's own lock.
+    """
+    global reaper_thread
+    if not hasattr(os, "waitid"):
+        def waiter():
+            proc.wait()
+            wake_event.set()
+        threading.Thread(target=waiter, daemon=True).start()
+        return
+    with watched_lock:
+        watched_procs[proc.pid] = proc
+        if reaper_thread is None:
+            reaper_thread = threading.Thread(target=reap_children, daemon=True)
+            reaper_thread.start()
+    watched_added.set()
+
+
 # ─── Camera Management ─────────────────────────────────────────────────
 
 def get_current_camera():
     """Get the current camera from config."""
-    cameras = config["cameras"]
+    cameras = config.cameras
     return cameras[current_camera_index % len(cameras)]
 
 
+def peek_next_camera():
+    """Get the camera that advance_camera() will switch to."""
+    cameras = config.cameras
+    return cameras[(current_camera_index + 1) % len(cameras)]
+
+
+def same_source(a, b):
+    """True if two cameras pull the same upstream stream."""
+    return (a.stream_url or a.youtube_id) == (b.stream_url or b.youtube_id)
+
+
 def advance_camera():
     """Advance to the next camera."""
     global current_camera_index
-    cameras = config["cameras"]
+    cameras = config.cameras
     current_camera_index = (current_camera_index + 1) % len(cameras)
     return get_current_camera()
 
 
-def start_camera_feed(camera):
-    """Start a camera feed and return the output pipe.
-    
-    Accepts either:
-    - camera with 'stream_url': use ffmpeg directly on the HLS URL
-    - camera with 'youtube_id': use yt-dlp to get stream (fallback)
+# ─── YouTube Manifests ─────────────────────────────────────────────────
+
+_cookie_file = None
+
+
+def youtube_cookie_file():
+    """Path of the YouTube cookie file to use, or None.
+
+    Cookies help bypass bot detection on cloud IPs. A cookies.txt next to
+    the script wins; otherwise YOUTUBE_COOKIES is written to a temp file
+    once and reused.
     """
-    ffmpeg_opts = config["ffmpeg"]
-    video_bitrate = ffmpeg_opts.get("video_bitrate", "6800k")
-    audio_bitrate = ffmpeg_opts.get("audio_bitrate", "128k")
-    resolution = ffmpeg_opts.get("resolution", "1920x1080")
-    framerate = ffmpeg_opts.get("framerate", 30)
-
-    stream_url = camera.get("stream_url")
-    youtube_id = camera.get("youtube_id")
+    global _cookie_file
+    if _cookie_file:
+        return _cookie_file
+    cookie_file_path = SCRIPT_DIR / "cookies.txt"
+    if cookie_file_path.exists():
+        _cookie_file = str(cookie_file_path)
+    else:
+        youtube_cookies = os.environ.get("YOUTUBE_COOKIES")
+        logger.info(f"YouTube cookies available: {bool(youtube_cookies)}")
+        if not youtube_cookies:
+            return None
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+            f.write(youtube_cookies)
+        _cookie_file = f.name
+    logger.info(f"Using cookie file: {_cookie_file}")
+    return _cookie_file
+
+
+def youtube_dl_options():
+    """Options for the in-process yt_dlp.YoutubeDL used to resolve streams."""
+    opts = {
+        "quiet": True,
+        "no_warnings": True,
+        "skip_download": True,
+        "format": "b[protocol^=m3u8]/b",
+    }
     youtube_api_key = os.environ.get("YOUTUBE_API_KEY")
+    if youtube_api_key:
+        opts["extractor_args"] = {"youtube": {"api_key": [youtube_api_key]}}
+    cookie_file = youtube_cookie_file()
+    if cookie_file:
+        opts["cookiefile"] = cookie_file
+    return opts
 
-    if stream_url:
-        source_cmd = [
-            "ffmpeg",
-            "-hide_banner", "-loglevel", "warning",
-            "-i", stream_url,
-            "-reconnect", "1",
-            "-reconnect_streamed", "1",
-            "-reconnect_delay_max", "5",
-        ]
-    elif youtube_id:
-        ydl_cmd = [
-            "yt-dlp",
-            "-f", "best",
-            "--hls-prefer-ffmpeg",
-            "-o", "-",
-        ]
-        if youtube_api_key:
-            ydl_cmd.extend(["--extractor-args", f"youtube:api_key={youtube_api_key}"])
-        
-        # Use YouTube cookies if available (to bypass bot detection on cloud IPs)
-        # Try to read from cookies.txt file first, then fall back to env var
-        cookie_file_path = SCRIPT_DIR / "cookies.txt"
-        if cookie_file_path.exists():
-            cookie_file = str(cookie_file_path)
-            logger.info(f"Using cookie file: {cookie_file}")
-        else:
-            youtube_cookies = os.environ.get("YOUTUBE_COOKIES")
-            logger.info(f"YouTube cookies available: {bool(youtube_cookies)}")
-            if youtube_cookies:
-                import tempfile
-                cookie_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
-                cookie_file.write(youtube_cookies)
-                cookie_file.close()
-                logger.info(f"Using cookie file: {cookie_file.name}")
-                cookie_file = cookie_file.name
-            else:
-                cookie_file = None
-        
-        if cookie_file:
-            ydl_cmd.extend(["--cookies", cookie_file])
-        
-        ydl_cmd.append(f"https://www.youtube.com/watch?v={youtube_id}")
-        source_cmd = ydl_cmd
+
+# YouTube signs its expiry into manifest URLs: .../expire/1700000000/...
+_EXPIRE_RE = re.compile(r'[/?&]expire[/=](\d+)')
+EXPIRE_MARGIN = 300  # Re-resolve this many seconds before a URL expires
+
+
+class ManifestCache:
+    """Resolves YouTube video IDs to HLS manifest URLs and caches them.
+
+    Resolving in-process with the yt_dlp API replaces a yt-dlp CLI run
+    (process start, imports, extractor discovery) on every switch. URLs
+    are kept until shortly before their signed expiry (hours for live
+    streams); ttl applies to URLs that don't carry one.
+    """
+
+    def __init__(self, ttl=240):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._ydl = None
+
+    def get(self, youtube_id, fresh_for=0):
+        """Return (manifest_url, http_headers) for a YouTube video ID.
+
+        A cached entry that expires within fresh_for seconds is re-resolved.
+        """
+        # One lock for lookups and extraction: YoutubeDL isn't thread-safe
+        with self._lock:
+            entry = self._entries.get(youtube_id)
+            if entry and time.monotonic() + fresh_for < entry[2]:
+                return entry[0], entry[1]
+            if self._ydl is None:
+                self._ydl = yt_dlp.YoutubeDL(youtube_dl_options())
+            # ie_key skips probing every other extractor's URL pattern
+            info = self._ydl.extract_info(
+                f"https://www.youtube.com/watch?v={youtube_id}",
+                download=False, ie_key="Youtube")
+            url = info["url"]
+            headers = info.get("http_headers") or {}
+            self._entries[youtube_id] = (url, headers, time.monotonic() + self._lifetime(url))
+            return url, headers
+
+    def _lifetime(self, url):
+        """Seconds a resolved URL may be served from the cache."""
+        match = _EXPIRE_RE.search(url)
+        if not match:
+            return self._ttl
+        return max(0, int(match.group(1)) - time.time() - EXPIRE_MARGIN)
+
+    def invalidate(self, youtube_id):
+        """Forget a URL, e.g. after its feed failed (stream restarted)."""
+        # No lock: dict.pop is atomic, and waiting out an extraction in
+        # progress on another thread would stall the caller
+        self._entries.pop(youtube_id, None)
+
+
+manifest_cache = ManifestCache()
+
+
+def resolve_manifest(camera, fresh_for=0):
+    """Resolve a YouTube camera into the cache, logging failures."""
+    if camera.youtube_id and not camera.stream_url:
+        try:
+            manifest_cache.get(camera.youtube_id, fresh_for)
+        except Exception as e:
+            logger.warning(f"Could not resolve stream for {camera.name}: {e}")
+
+
+# Background resolution; one worker, since ManifestCache serializes
+# extractions on its lock anyway
+manifest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="manifest")
+manifest_futures = {}  # youtube_id -> Future of the latest warm-up
+
+
+def warm_manifest(camera, fresh_for):
+    """Resolve a camera's manifest in the background, ahead of its prefetch.
+
+    Keeps a slow yt-dlp extraction (cache expired) out of stream_loop,
+    which would otherwise block in prepare_feed only seconds before the
+    switch. A warm-up already queued for the camera is not repeated.
+    """
+    if camera.youtube_id and not camera.stream_url:
+        future = manifest_futures.get(camera.youtube_id)
+        if future is None or future.done():
+            manifest_futures[camera.youtube_id] = manifest_executor.submit(
+                resolve_manifest, camera, fresh_for)
+
+
+def prewarm_manifests():
+    """Queue every YouTube camera for resolution so early switches hit the cache.
+
+    One task per camera, so shutdown's cancel_futures drops the ones not
+    yet started instead of waiting out a whole startup sweep.
+    """
+    for camera in config.cameras:
+        warm_manifest(camera, 0)
+
+
+# ─── Camera Feeds ──────────────────────────────────────────────────────
+
+def start_camera_feed(camera):
+    """Start a camera feed and return its process.
+
+    The process is an ffmpeg that remuxes the camera's HLS stream to
+    MPEG-TS on stdout, which the buffer thread forwards to the persistent
+    ffmpeg. The persistent ffmpeg does the single encode for whichever
+    camera is on air.
+
+    Accepts either:
+    - camera with 'stream_url': use that HLS URL directly
+    - camera with 'youtube_id': resolve its HLS manifest via yt_dlp
+    """
+    headers = {}
+    if camera.stream_url:
+        stream_url = camera.stream_url
+    elif camera.youtube_id:
+        try:
+            stream_url, headers = manifest_cache.get(camera.youtube_id)
+        except Exception as e:
+            logger.error(f"Could not resolve stream for {camera.name}: {e}")
+            return None
     else:
         logger.error("Camera config must have either stream_url or youtube_id")
         return None
 
-    normalize_cmd = [
-        "ffmpeg",
-        "-hide_banner", "-loglevel", "error",
-        "-i", "pipe:0",
-        "-c:v", "libx264", "-preset", "veryfast",
-        "-b:v", video_bitrate, "-maxrate", video_bitrate,
-        "-bufsize", str(int(video_bitrate.replace("k", "")) * 2) + "k",
-        "-s", resolution,
-        "-r", str(framerate),
-        "-g", str(framerate * 2),
-        "-c:a", "aac", "-b:a", audio_bitrate, "-ar", "44100", "-ac", "2",
-        "-fflags", "+genpts",
-        "-reset_timestamps", "1",
+    source_cmd = [
+        FFMPEG,
+        "-hide_banner", "-loglevel", "warning", "-nostdin",
+        "-reconnect", "1",
+        "-reconnect_streamed", "1",
+        "-reconnect_delay_max", "5",
+        "-fflags", "+nobuffer",
+        "-flags", "+low_delay",
+        "-probesize", "200000",
+        "-analyzeduration", "200000",
+    ]
+    if headers:
+        source_cmd.extend(["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())])
+    source_cmd.extend([
+        "-i", stream_url,
+        "-threads", str(FEED_THREADS),
+        "-c", "copy",
         "-f", "mpegts",
         "pipe:1",
-    ]
-
-    def log_stderr(proc, name):
-        def reader():
-            for line in proc.stderr:
-                logger.warning(f"{name}: {line.decode().strip()}")
-        return reader
+    ])
 
     try:
-        if stream_url:
-            source_proc = subprocess.Popen(
-                source_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True,
-            )
-            stderr_thread = threading.Thread(target=log_stderr(source_proc, "ffmpeg-source"), daemon=True)
-            stderr_thread.start()
-            norm_proc = subprocess.Popen(
-                normalize_cmd,
-                stdin=source_proc.stdout,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True,
-            )
-            source_proc.stdout.close()
-            return (source_proc, norm_proc)
-        else:
-            ydl_proc = subprocess.Popen(
-                source_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True,
-            )
-            stderr_thread = threading.Thread(target=log_stderr(ydl_proc, "yt-dlp"), daemon=True)
-            stderr_thread.start()
-            norm_proc = subprocess.Popen(
-                normalize_cmd,
-                stdin=ydl_proc.stdout,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True,
-            )
-            ydl_proc.stdout.close()
-            return (ydl_proc, norm_proc)
+        # Python's own fds are already close-on-exec, so the child gets
+        # only these three; no need for pass_fds
+        source_proc = subprocess.Popen(
+            source_cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        log_stderr(source_proc, "ffmpeg-source")
+        enlarge_pipe(source_proc.stdout, FEED_PIPE_SIZE)
+        # Non-blocking, so the buffer thread splices until the pipe is dry
+        os.set_blocking(source_proc.stdout.fileno(), False)
+        pin_process(source_proc, FEED_CPUS)
+        watch_process(source_proc)
+        return source_proc
     except Exception as e:
         logger.error(f"Failed to start camera feed: {e}")
         return None
 
 
 def stop_camera_feed(camera_proc):
-    """Stop a camera feed."""
-    if not camera_proc:
+    """Stop a camera feed without waiting for it to exit.
+
+    Feeds only remux into a pipe nobody reads any more, so there is nothing
+    to flush: SIGKILL the feed's session and let the reaper thread (see
+    watch_process) collect it, instead of blocking the switch on wait().
+    """
+    if not camera_proc or camera_proc.poll() is not None:
         return
-    ydl_proc, norm_proc = camera_proc
-    for proc in [ydl_proc, norm_proc]:
-        if proc and proc.poll() is None:
+    try:
+        # start_new_session made the feed its own process group leader
+        os.killpg(camera_proc.pid, signal.SIGKILL)
+    except OSError:
+        camera_proc.kill()
+
+
+def trim_to_ts_packet(chunks):
+    """Drop leading bytes from a list of chunks up to a TS packet boundary.
+
+    A boundary is a sync byte (0x47) with another one a packet later, or
+    with the data ending before then. Chunks with no boundary near their
+    head are returned as they are; ffmpeg's demuxer resyncs on its own.
+    """
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 2 * TS_PACKET_SIZE:
+            break
+    for skip in range(min(len(head), TS_PACKET_SIZE)):
+        if head[skip] == 0x47 and (skip + TS_PACKET_SIZE >= len(head)
+                                   or head[skip + TS_PACKET_SIZE] == 0x47):
+            break
+    else:
+        return chunks
+    chunks = list(chunks)
+    while chunks and skip >= len(chunks[0]):
+        skip -= len(chunks.pop(0))
+    if skip:
+        chunks[0] = chunks[0][skip:]
+    return chunks
+
+
+class PendingFeed:
+    """A camera feed started ahead of its switch.
+
+    A background thread keeps the feed's pipe drained into a small ring of
+    the newest chunks, so the source stays at the live edge instead of
+    stalling on a full pipe. At cutover the ring is handed to the buffer
+    thread, which writes it out before reading the feed directly. Reads
+    don't follow packet boundaries, so once the ring has dropped its
+    oldest chunk the hand-over is trimmed to the next TS packet.
+    """
+
+    def __init__(self, camera, proc):
+        self.camera = camera
+        self.proc = proc
+        self.buffer = deque(maxlen=PREFETCH_CHUNKS)
+        self.buffered = 0
+        self.dropped = False  # The ring has overflowed; its head may be mid-packet
+        self.data_ready = threading.Event()  # At least one TS packet arrived
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        fd = self.proc.stdout.fileno()
+        while not self._stop.is_set():
+            ready, _, _ = select.select([fd], [], [], 0.1)
+            if not ready:
+                continue
             try:
-                proc.terminate()
-                proc.wait(timeout=2)
-            except:
-                try:
-                    proc.kill()
-                except:
-                    pass
+                data = os.read(fd, PREFETCH_CHUNK_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            if len(self.buffer) == PREFETCH_CHUNKS:
+                self.dropped = True
+            self.buffer.append(data)
+            self.buffered += len(data)
+            if not self.data_ready.is_set() and self.buffered >= TS_PACKET_SIZE:
+                self.data_ready.set()
+                wake_event.set()
+
+    def detach(self):
+        """Stop draining; return the feed process and its buffered chunks."""
+        self._stop.set()
+        self._thread.join(timeout=1)
+        if self.dropped:
+            return self.proc, trim_to_ts_packet(self.buffer)
+        return self.proc, list(self.buffer)
+
+
+def prepare_feed(camera):
+    """Start a camera feed and begin prefetching it. Returns a PendingFeed."""
+    proc = start_camera_feed(camera)
+    if not proc:
+        return None
+    return PendingFeed(camera, proc)
 
 
 # ─── Buffer Thread ─────────────────────────────────────────────────────
 
+# splice() flags: move pages rather than copy, more data is coming
+SPLICE_FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_MORE", 0)
+_splice = getattr(os, "splice", None)  # Linux, Python 3.10+
+
+
+def pump(src_fd, dst_fd, size=1 << 20):
+    """Move up to size bytes that are ready on src_fd to dst_fd.
+
+    Uses splice() where available, so pipe-to-pipe bytes never leave the
+    kernel. Otherwise falls back to a 256KB read/write through userspace.
+    Returns the number of bytes moved; 0 means EOF on src_fd.
+    """
+    global _splice
+    if _splice:
+        try:
+            return _splice(src_fd, dst_fd, size, flags=SPLICE_FLAGS)
+        except OSError as e:
+            # Some kernels/sandboxes lack splice() for these fds; without
+            # this the buffer thread would retry it forever and stall
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+            logger.warning(f"splice() unavailable ({e}); copying through userspace")
+            _splice = None
+    data = os.read(src_fd, 262144)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view):]
+    return len(data)
+
+
+def write_chunks(fd, chunks):
+    """Write a list of buffers to fd with writev(), without joining them."""
+    views = [memoryview(c) for c in chunks]
+    while views:
+        n = os.writev(fd, views)
+        while views and n >= len(views[0]):
+            n -= len(views.pop(0))
+        if views and n:
+            views[0] = views[0][n:]
+
+
 def buffer_writer():
     """
-    Continuously reads from the active camera and writes to ffmpeg's stdin.
+    Continuously moves data from the active camera to ffmpeg's stdin.
     This runs in a separate thread and never stops - we just swap which
     camera we read from when switching.
     """
-    global current_camera_proc
-
-    while not buffer_stop_event.is_set():
+    global current_camera_proc, camera_prebuffer
+
+    # Poll sets for the thread: the camera fd (swapped in on switches) for
+    # POLLIN, and ffmpeg's stdin for POLLOUT
+    src_poller = select.poll()
+    dst_poller = select.poll()
+    polled_proc = None
+    src_fd = dst_fd = None
+
+    # Bound methods hoisted out of the transfer loop
+    src_poll = src_poller.poll
+    dst_poll = dst_poller.poll
+    stopping = buffer_stop_event.is_set
+    flowing = camera_flowing.is_set
+    sleep = time.sleep
+
+    while not stopping():
         # Get current camera process - re-check frequently to detect switches
         with camera_lock:
             cam_proc = current_camera_proc
+            prebuffer = camera_prebuffer
+            camera_prebuffer = None
 
-        if not cam_proc:
-            time.sleep(0.01)  # Short sleep when no camera
+        if not cam_proc or not ffmpeg_proc or not ffmpeg_proc.stdin:
+            sleep(0.01)  # Short sleep when no camera
             continue
 
-        _, norm_proc = cam_proc
-        stdout = norm_proc.stdout
-
-        # Read data from camera and write to ffmpeg
-        # Use very short timeout so we re-check current_camera_proc frequently
+        # Flush what was prefetched before the switch
+        if prebuffer:
+            try:
+                write_chunks(ffmpeg_proc.stdin.fileno(), prebuffer)
+            except (BrokenPipeError, OSError):
+                # ffmpeg died
+                return
+            camera_flowing.set()
+            wake_event.set()
+
+        # Move data from camera to ffmpeg
+        # Short poll timeouts so we re-check current_camera_proc frequently
         data_written = False
+        waited = False
         try:
-            for _ in range(10):  # Try multiple reads per camera check
-                ready, _, _ = select.select([stdout], [], [], 0.01)
-                if ready:
-                    data = stdout.read(262144)  # Read up to 256KB chunks
-                    if data and ffmpeg_proc and ffmpeg_proc.stdin:
-                        try:
-                            ffmpeg_proc.stdin.write(data)
-                            ffmpeg_proc.stdin.flush()
-                            data_written = True
-                        except (BrokenPipeError, OSError):
-                            # ffmpeg died
-                            return
-                    elif not data:
-                        # Camera ended (EOF) - break to check for new camera
+            if cam_proc is not polled_proc:
+                # Camera swapped: look the fds up once, not per transfer
+                if src_fd is not None:
+                    src_poller.unregister(src_fd)
+                src_fd = cam_proc.stdout.fileno()
+                src_poller.register(src_fd, select.POLLIN)
+                if dst_fd != ffmpeg_proc.stdin.fileno():
+                    if dst_fd is not None:
+                        dst_poller.unregister(dst_fd)
+                    dst_fd = ffmpeg_proc.stdin.fileno()
+                    dst_poller.register(dst_fd, select.POLLOUT)
+                polled_proc = cam_proc
+            for _ in range(32):  # Bounded so switches are picked up promptly
+                try:
+                    moved = pump(src_fd, dst_fd)
+                except BlockingIOError:
+                    # splice() on the non-blocking camera pipe fails with
+                    # EAGAIN both when the camera has nothing and when
+                    # ffmpeg's stdin is full. Block until the camera has
+                    # data and then until ffmpeg can take it; either wait
+                    # timing out ends the batch
+                    if not src_poll(10) or not dst_poll(10):
+                        waited = True
                         break
-                else:
-                    # No data available, check if camera changed
+                    continue
+                if not moved:
+                    # Camera ended (EOF) - break to check for new camera
                     break
+                data_written = True
+            if data_written and not flowing() and cam_proc is current_camera_proc:
+                camera_flowing.set()
+                wake_event.set()
+        except BrokenPipeError:
+            # ffmpeg died
+            return
         except (ValueError, OSError):
             # Pipe closed or other error - camera probably stopped
-            time.sleep(0.005)
+            sleep(0.005)
         except Exception as e:
             logger.debug(f"Buffer writer error: {e}")
-            time.sleep(0.005)
+            sleep(0.005)
 
-        # If we didn't write any data, do a tiny sleep to prevent busy-wait
-        if not data_written:
-            time.sleep(0.005)
+        # A timed-out poll already blocked (GIL released), whether the camera
+        # was empty or ffmpeg was backed up, so only sleep when nothing did:
+        # an error, or EOF before any data
+        if not data_written and not waited:
+            sleep(0.005)
 
 
 # ─── FFmpeg ────────────────────────────────────────────────────────────
 
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+
+def available_encoders():
+    """Names of the encoders compiled into this ffmpeg build."""
+    try:
+        out = subprocess.run(
+            [FFMPEG, "-hide_banner", "-encoders"],
+            capture_output=True, text=True, timeout=10,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return set()
+    # Lines look like " V....D h264_nvenc  NVIDIA NVENC H.264 encoder"
+    return {parts[1] for parts in map(str.split, out.splitlines()) if len(parts) > 1}
+
+
+def detect_hw_encoder():
+    """Pick a hardware H.264 encoder the host and ffmpeg build support, else libx264."""
+    encoders = available_encoders()
+    if sys.platform == "darwin" and "h264_videotoolbox" in encoders:
+        return "videotoolbox"
+    if os.path.exists(VAAPI_DEVICE) and "h264_vaapi" in encoders:
+        return "vaapi"
+    if shutil.which("nvidia-smi") and "h264_nvenc" in encoders:
+        return "nvenc"
+    return "libx264"
+
+
+def video_encoder_args(encoder, ffmpeg_opts):
+    """Build the ffmpeg video encoding options for the given encoder."""
+    if encoder == "copy":
+        # Pass the camera's H.264 through untouched: no decode or encode
+        return ["-c:v", "copy"]
+    video_bitrate = ffmpeg_opts.video_bitrate
+    bufsize = str(int(video_bitrate.replace("k", "")) * 2) + "k"
+    framerate = ffmpeg_opts.framerate
+    width, height = ffmpeg_opts.resolution.split("x")
+    # Cameras differ in resolution; every encoder gets the same scaled frames
+    scale = f"scale={width}:{height}"
+    gop = str(max(1, round(framerate * ffmpeg_opts.keyframe_interval)))
+    rate_args = ["-r", str(framerate), "-g", gop]
+    # libx264's -tune zerolatency and NVENC's -tune ll already drop
+    # B-frames; the VAAPI and QSV encoders need it spelled out
+    no_bframes = ["-bf", "0"]
+
+    if encoder == "vaapi":
+        # Scale in software, then upload frames to the GPU for encoding
+        return [
+            "-vf", f"{scale},format=nv12,hwupload",
+            "-c:v", "h264_vaapi",
+            "-b:v", video_bitrate, "-maxrate", video_bitrate,
+        ] + no_bframes + rate_args
+    if encoder == "qsv":
+        # Intel Quick Sync takes system-memory NV12 and uploads it itself
+        return [
+            "-vf", f"{scale},format=nv12",
+            "-c:v", "h264_qsv", "-preset", "veryfast", "-look_ahead", "0",
+            "-b:v", video_bitrate, "-maxrate", video_bitrate, "-bufsize", bufsize,
+        ] + no_bframes + rate_args
+    if encoder == "videotoolbox":
+        # macOS media engine
+        return [
+            "-vf", scale,
+            "-c:v", "h264_videotoolbox", "-realtime", "1",
+            "-b:v", video_bitrate, "-maxrate", video_bitrate, "-bufsize", bufsize,
+        ] + rate_args
+    if encoder == "nvenc":
+        return [
+            "-vf", scale,
+            "-c:v", "h264_nvenc", "-preset", "p4", "-tune", "ll", "-rc", "cbr",
+            "-b:v", video_bitrate, "-maxrate", video_bitrate, "-bufsize", bufsize,
+        ] + rate_args
+    return [
+        "-vf", scale,
+        "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency",
+        "-b:v", video_bitrate, "-maxrate", video_bitrate, "-bufsize", bufsize,
+        # Fixed GOP: no scene-cut keyframes drifting off the interval
+        "-keyint_min", gop, "-sc_threshold", "0",
+    ] + rate_args
+
+
 def start_ffmpeg():
     """Start the single persistent ffmpeg process reading from stdin via pipe."""
     global ffmpeg_proc
 
-    ffmpeg_opts = config["ffmpeg"]
-    stream_opts = config["stream"]
-    audio_opts = config["audio"]
-    preview_mode = stream_opts.get("preview_mode", True)
+    ffmpeg_opts = config.ffmpeg
+    stream_opts = config.stream
+    preview_mode = stream_opts.preview_mode
 
-    video_bitrate = ffmpeg_opts.get("video_bitrate", "4500k")
-    audio_bitrate = ffmpeg_opts.get("audio_bitrate", "128k")
-    framerate = ffmpeg_opts.get("framerate", 30)
-    music_volume = audio_opts.get("music_volume", 0.3)
-    music_file = audio_opts.get("music_file", "")
+    audio_bitrate = ffmpeg_opts.audio_bitrate
 
-    if music_file and not os.path.isabs(music_file):
-        music_file = str(SCRIPT_DIR / music_file)
+    encoder = ffmpeg_opts.encoder
+    if encoder == "auto":
+        encoder = detect_hw_encoder()
+    logger.info(f"Video encoder: {encoder}")
+    if encoder == "copy" and len(config.cameras) > 1:
+        # Each camera has its own SPS/PPS, resolution and timestamps
+        logger.warning("encoder: copy re-encodes nothing, so players may glitch at every camera switch; use it for single-camera streams")
 
     ffmpeg_cmd = [
-        "ffmpeg",
+        FFMPEG,
         "-hide_banner", "-loglevel", "warning",
         "-nostdin",
+    ]
+    if encoder == "vaapi":
+        ffmpeg_cmd.extend(["-vaapi_device", VAAPI_DEVICE])
+    ffmpeg_cmd.extend([
         "-fflags", "+genpts+igndts+discardcorrupt+nobuffer",
         "-flags", "+low_delay",
+        "-probesize", "200000",
+        "-analyzeduration", "200000",
+        "-avioflags", "direct",
         "-thread_queue_size", "4096",
         "-f", "mpegts",
         "-err_detect", "ignore_err",
         "-i", "pipe:0",  # Read from stdin
-    ]
+    ])
 
-    if music_file and os.path.exists(music_file):
+    if music_path:
         ffmpeg_cmd.extend([
-            "-stream_loop", "-1", "-i", music_file,
-            "-filter_complex", f"[1:a]volume={music_volume}[music];[0:a][music]amix=inputs=2:duration=first[aout]",
+            # Pace only the looped local file; the camera pipe is already live
+            "-re", "-stream_loop", "-1", "-i", music_path,
+            "-filter_complex", music_mix_filter,
             "-map", "0:v", "-map", "[aout]",
         ])
+    else:
+        ffmpeg_cmd.extend(["-af", CAMERA_AUDIO_FILTER])
 
+    # Single encode for whichever camera is on air
+    ffmpeg_cmd.extend(video_encoder_args(encoder, ffmpeg_opts))
     ffmpeg_cmd.extend([
-        "-c:v", "copy",
-        "-c:a", "aac", "-b:a", audio_bitrate,
+        "-c:a", "aac", "-b:a", audio_bitrate, "-ar", "44100", "-ac", "2",
+        "-threads", str(ENCODER_THREADS),
+        "-filter_threads", "2",
     ])
 
-    rtmp_url = stream_opts.get("youtube", {}).get("rtmp_url", "")
-    stream_key = stream_opts.get("youtube", {}).get("stream_key", "")
+    rtmp_url = stream_opts.youtube.rtmp_url
+    stream_key = stream_opts.youtube.stream_key
     
     outputs = []
     
     if preview_mode:
-        outputs.append(f"hls://{os.path.join(hls_dir, 'stream.m3u8')}")
+        outputs.append(f"hls://{os.path.join(hls_dir, 'live.m3u8')}")
     
     if stream_key:
         outputs.append(f"flv://{rtmp_url}/{stream_key}")
@@ -550,11 +1462,14 @@ def start_ffmpeg():
             ffmpeg_cmd.extend([
                 "-f", "hls",
                 "-hls_time", "1",
-                "-hls_list_size", "5",
-                "-hls_flags", "delete_segments+omit_endlist",
-                "-hls_segment_type", "mpegts",
-                "-hls_segment_filename", os.path.join(hls_dir, "seg%05d.ts"),
-                os.path.join(hls_dir, "stream.m3u8"),
+                "-hls_list_size", "4",
+                # temp_file: segments appear atomically, never half-written
+                "-hls_flags", "delete_segments+temp_file+independent_segments+omit_endlist",
+                "-hls_allow_cache", "0",
+                "-hls_segment_type", "fmp4",
+                "-hls_fmp4_init_filename", "init.mp4",
+                "-hls_segment_filename", os.path.join(hls_dir, "seg%05d.m4s"),
+                os.path.join(hls_dir, "live.m3u8"),
             ])
         else:
             ffmpeg_cmd.extend(["-f", "flv", f"{rtmp_url}/{stream_key}"])
@@ -564,11 +1479,15 @@ def start_ffmpeg():
     ffmpeg_proc = subprocess.Popen(
         ffmpeg_cmd,
         stdin=subprocess.PIPE,  # We write to this
-        stdout=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
         stderr=subprocess.PIPE,
         cwd=str(SCRIPT_DIR),
         start_new_session=True,
     )
+    log_stderr(ffmpeg_proc, "ffmpeg")
+    enlarge_pipe(ffmpeg_proc.stdin)
+    pin_process(ffmpeg_proc, ENCODER_CPUS)
+    watch_process(ffmpeg_proc)
     return True
 
 
@@ -593,18 +1512,35 @@ def stop_ffmpeg():
 
 # ─── Main loop ──────────────────────────────────────────────────────────
 
+def wait_until(ready, timeout):
+    """Block until ready() is true, shutdown, or timeout; returns ready().
+
+    Sleeps on wake_event, so there is no periodic polling.
+    """
+    deadline = time.monotonic() + timeout
+    while not stop_event.is_set():
+        wake_event.clear()
+        if ready():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        wake_event.wait(remaining)
+    return ready()
+
+
 def stream_loop():
     """Main loop that cycles through cameras."""
-    global running, current_camera_index, current_camera_proc, buffer_thread
+    global running, current_camera_index, current_camera_proc, camera_prebuffer, buffer_thread
 
-    switch_interval = config["stream"]["switch_interval"]
-    cameras = config["cameras"]
+    switch_interval = config.stream.switch_interval
+    cameras = config.cameras
 
     logger.info(f"Starting stream loop with {len(cameras)} cameras")
     logger.info(f"Each camera shown for {switch_interval} seconds")
 
     current_cam = get_current_camera()
-    logger.info(f"Starting with camera: {current_cam['name']}")
+    logger.info(f"Starting with camera: {current_cam.name}")
 
     # Start first camera
     cam_proc = start_camera_feed(current_cam)
@@ -621,10 +1557,18 @@ def stream_loop():
     buffer_thread = threading.Thread(target=buffer_writer, daemon=True)
     buffer_thread.start()
 
+    pending = None
     while running and not stop_event.is_set():
-        # Wait for the switch interval
-        elapsed = 0
-        while running and elapsed < switch_interval and not stop_event.is_set():
+        # Wait for the switch interval, warming up the next camera near its
+        # end. Child exits and shutdown wake us through wake_event.
+        deadline = time.monotonic() + switch_interval
+        prefetch_at = deadline - PREFETCH_SECS
+        prefetched = False
+        # Make sure the next manifest will still be cached at prefetch time
+        warm_manifest(peek_next_camera(), switch_interval)
+        while running and not stop_event.is_set():
+            wake_event.clear()
+
             # Check if ffmpeg died
             if ffmpeg_proc and ffmpeg_proc.poll() is not None:
                 logger.error("ffmpeg process died unexpectedly")
@@ -635,70 +1579,88 @@ def stream_loop():
             with camera_lock:
                 cam = current_camera_proc
             if cam:
-                ydl_proc, norm_proc = cam
-                ydl_exit = ydl_proc.poll()
-                norm_exit = norm_proc.poll()
-                if ydl_exit is not None or norm_exit is not None:
-                    logger.warning(f"Camera feed ended (offline?), switching early... ydl_exit={ydl_exit}, norm_exit={norm_exit}")
+                feed_exit = cam.poll()
+                if feed_exit is not None:
+                    logger.warning(f"Camera feed ended (offline?), switching early... exit={feed_exit}")
+                    # Its manifest URL may be dead; resolve afresh next time
+                    failed = get_current_camera()
+                    if failed.youtube_id:
+                        manifest_cache.invalidate(failed.youtube_id)
                     break
 
-            time.sleep(1)
-            elapsed += 1
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            if not prefetched and now >= prefetch_at:
+                prefetched = True
+                upcoming = peek_next_camera()
+                if cam and same_source(upcoming, get_current_camera()):
+                    logger.info(f"Next camera {upcoming.name} shares the current feed, not prefetching")
+                else:
+                    logger.info(f"Prefetching camera: {upcoming.name}")
+                    pending = prepare_feed(upcoming)
+
+            wake_at = deadline if prefetched else prefetch_at
+            wake_event.wait(max(0, wake_at - time.monotonic()))
 
         if not running or stop_event.is_set():
             break
 
-        # Switch to next camera
+        # Switch to next camera. One pulling the same stream as the live
+        # feed just takes it over rather than spawning a duplicate.
+        on_air = get_current_camera()
         next_cam = advance_camera()
-        logger.info(f"Starting transition to camera: {next_cam['name']} (stream will update in ~5 seconds)")
-
-        # Start new camera BEFORE stopping old one (seamless transition)
-        new_cam_proc = start_camera_feed(next_cam)
-        if not new_cam_proc:
-            logger.error(f"Failed to start camera: {next_cam['name']}, keeping current")
+        with camera_lock:
+            cam = current_camera_proc
+        if pending is None and cam and cam.poll() is None and same_source(next_cam, on_air):
+            logger.info(f"Camera {next_cam.name} shares the current feed, keeping it")
+            continue
+        logger.info(f"Starting transition to camera: {next_cam.name}")
+
+        # Start new camera BEFORE stopping old one (seamless transition).
+        # Normally it is already running from the prefetch.
+        if pending is None:
+            pending = prepare_feed(next_cam)
+        if pending is None:
+            logger.error(f"Failed to start camera: {next_cam.name}, keeping current")
             continue
 
         # Wait for new camera to actually produce data before swapping
-        # This prevents gaps in the stream
-        _, new_norm_proc = new_cam_proc
-        new_stdout = new_norm_proc.stdout
-        data_ready = False
-        wait_start = time.time()
-        max_wait = 10  # Max 10 seconds to start producing data
-
-        while time.time() - wait_start < max_wait and not stop_event.is_set():
-            ready, _, _ = select.select([new_stdout], [], [], 0.1)
-            if ready:
-                data_ready = True
-                break
-            time.sleep(0.1)
+        # This prevents gaps in the stream (max 10 seconds)
+        if not wait_until(pending.data_ready.is_set, 10):
+            logger.warning(f"Camera {next_cam.name} slow to start, switching anyway")
 
-        if not data_ready:
-            logger.warning(f"Camera {next_cam['name']} slow to start, switching anyway")
+        logger.info(f"Switching to camera: {next_cam.name}")
 
-        logger.info(f"Switching to camera: {next_cam['name']}")
-
-        # Atomically swap to new camera
+        # Atomically swap to new camera, handing over what it prefetched
+        new_cam_proc, prebuffer = pending.detach()
+        pending = None
         old_cam_proc = None
         with camera_lock:
             old_cam_proc = current_camera_proc
             current_camera_proc = new_cam_proc
+            camera_prebuffer = prebuffer
+            camera_flowing.clear()
 
         # Stop old camera after swap
         if old_cam_proc:
             stop_camera_feed(old_cam_proc)
 
-        # Allow time for ffmpeg to process buffered data and start new camera
-        # HLS has inherent delay (segment_time * list_size + encoding buffer)
-        time.sleep(2)
-
-        logger.info(f"Switched to camera: {next_cam['name']} (new camera now visible)")
+        # Wait until the new camera's bytes actually reach ffmpeg
+        if wait_until(camera_flowing.is_set, 5):
+            logger.info(f"Switched to camera: {next_cam.name} (new camera now visible)")
+        else:
+            logger.warning(f"Switched to camera: {next_cam.name}, but no data has arrived yet")
 
     # Cleanup
     buffer_stop_event.set()
     if buffer_thread:
         buffer_thread.join(timeout=2)
 
+    if pending:
+        stop_camera_feed(pending.detach()[0])
+
     with camera_lock:
         if current_camera_proc:
             stop_camera_feed(current_camera_proc)
@@ -708,11 +1670,37 @@ def stream_loop():
 
 
 def signal_handler(signum, frame):
+    """Only drop the flag; watch_signals does the rest off the main thread.
+
+    The handler runs on the main thread, possibly while it holds one of
+    the Events' locks in wait()/clear(), so setting an Event here could
+    deadlock. Python writes the signal number to the wakeup fd itself.
+    """
+    global running
+    running = False
+
+
+def watch_signals(fd):
+    """Turn SIGINT/SIGTERM bytes from the wakeup fd into a shutdown."""
     global running
+    shutdown_signals = {signal.SIGINT, signal.SIGTERM}
+    while not shutdown_signals & set(os.read(fd, 64)):
+        pass
     logger.info("Received shutdown signal")
     running = False
     stop_event.set()
     buffer_stop_event.set()
+    wake_event.set()
+
+
+def install_signal_handlers():
+    """Route shutdown signals through a self-pipe to watch_signals."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(write_fd, False)
+    signal.set_wakeup_fd(write_fd)
+    threading.Thread(target=watch_signals, args=(read_fd,), daemon=True).start()
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
 
 def main():
@@ -727,17 +1715,19 @@ def main():
 
     setup_logging()
     load_config(args.config, args.base_config)
+    reserve_cpus(config.runtime.cpu_mask)
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    install_signal_handlers()
 
     # Create temp dir for HLS segments
-    temp_dir = tempfile.mkdtemp(prefix="livestream_")
+    # (in RAM when /dev/shm is available, so segments never touch disk)
+    shm_dir = "/dev/shm" if os.path.ismount("/dev/shm") else None
+    temp_dir = tempfile.mkdtemp(prefix="livestream_", dir=shm_dir)
     hls_dir = temp_dir
     logger.info(f"Using temp dir: {temp_dir}")
 
     # Start HLS preview server if enabled
-    preview_mode = config["stream"].get("preview_mode", True)
+    preview_mode = config.stream.preview_mode
     if preview_mode:
         http_port = args.port
         http_thread = threading.Thread(target=start_http_server, args=(http_port,), daemon=True)
@@ -745,13 +1735,16 @@ def main():
 
     running = True
 
+    # Resolve YouTube manifests in the background while ffmpeg starts
+    prewarm_manifests()
+
     # Start ffmpeg
     if not start_ffmpeg():
         logger.error("Failed to start ffmpeg")
         sys.exit(1)
 
-    # Give ffmpeg a moment to initialize
-    time.sleep(1)
+    # No startup sleep: camera bytes wait in ffmpeg's 1 MiB stdin pipe, and
+    # stream_loop is woken at once if ffmpeg exits during startup
 
     try:
         stream_loop()
@@ -767,7 +1760,9 @@ def main():
         with camera_lock:
             if current_camera_proc:
                 stop_camera_feed(current_camera_proc)
-        import shutil
+        # Drop queued warm-ups; interpreter exit still waits for the one
+        # running (a single yt-dlp extraction, typically a few seconds)
+        manifest_executor.shutdown(wait=False, cancel_futures=True)
         shutil.rmtree(temp_dir, ignore_errors=True)
         logger.info("Streamer stopped")
 